@@ -1,8 +1,10 @@
 # app.py
-from fastapi import FastAPI, WebSocket
-from fastapi.responses import HTMLResponse
-from kktcmb_worker import run_kktcmb
+from fastapi import FastAPI, WebSocket, HTTPException
+from fastapi.responses import HTMLResponse, JSONResponse, FileResponse
+from kktcmb_worker import run_kktcmb, run_kktcmb_batch
+from kktcmb_trace import list_jobs, get_job, trace_zip_path
 import json
+import re
 
 app = FastAPI()
 
@@ -11,6 +13,33 @@ async def index():
     with open("templates/index.html", "r", encoding="utf-8") as f:
         return HTMLResponse(f.read())
 
+def _check_job_id(job_id: str):
+    if not re.fullmatch(r"[0-9a-f]{12}", job_id):
+        raise HTTPException(status_code=404, detail="job bulunamadı")
+
+
+@app.get("/traces")
+async def traces():
+    # son işler + toplam/aşama bazında p50/p95 (yavaş kuyruğu bulmak için)
+    return JSONResponse(list_jobs())
+
+@app.get("/traces/{job_id}")
+async def trace_detail(job_id: str):
+    _check_job_id(job_id)
+    job = get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="job bulunamadı")
+    return JSONResponse(job)
+
+@app.get("/traces/{job_id}/trace.zip")
+async def trace_zip(job_id: str):
+    # `playwright show-trace trace.zip` ile açılır
+    _check_job_id(job_id)
+    path = trace_zip_path(job_id)
+    if not path:
+        raise HTTPException(status_code=404, detail="bu iş için tracing kaydı yok")
+    return FileResponse(path, media_type="application/zip", filename=f"{job_id}-trace.zip")
+
 @app.websocket("/ws")
 async def websocket_endpoint(ws: WebSocket):
     await ws.accept()
@@ -29,3 +58,25 @@ async def websocket_endpoint(ws: WebSocket):
         await ws.send_text(json.dumps({"type": "error", "msg": str(e)}))
     finally:
         await ws.close()
+
+@app.websocket("/ws/batch")
+async def websocket_batch(ws: WebSocket):
+    # Birden çok döviz/tarih isteği: her indirme "result" mesajı olarak akar
+    await ws.accept()
+    try:
+        prompt = await ws.receive_text()
+
+        async def send_log(msg: str):
+            await ws.send_text(json.dumps({"type": "log", "msg": msg}))
+
+        async def send_result(res: dict):
+            await ws.send_text(json.dumps({"type": "result", "data": res}))
+
+        await send_log(f"💬 Toplu prompt alındı: {prompt}")
+        data = await run_kktcmb_batch(prompt, send_log, send_result)
+        await ws.send_text(json.dumps({"type": "meta", "data": data}))
+        await send_log("✅ Tamamlandı.")
+    except Exception as e:
+        await ws.send_text(json.dumps({"type": "error", "msg": str(e)}))
+    finally:
+        await ws.close()
@@ -0,0 +1 @@
+# Kök dizindeki conftest: pytest kök dizini sys.path'e ekler, testler kktcmb_* modüllerini doğrudan import eder.
@@ -0,0 +1,129 @@
+# kktcmb_batch.py
+# Toplu sorgu için saf (tarayıcı/LLM gerektirmeyen) yardımcılar: yerel prompt çözümleme,
+# dropdown eşleştirme, tarih aralığı birleştirme ve gönderim planı.
+import re
+from datetime import datetime, timedelta
+
+# Yerel hızlı yolda kabul edilen ISO 4217 kodları; listede olmayan 3 harfli büyük kelime LLM'e bırakılır
+ISO_CODES = frozenset("""
+    USD EUR GBP CHF SEK NOK DKK JPY CAD AUD NZD SAR KWD QAR AED BHD OMR JOD
+    RUB CNY KRW INR PKR IRR AZN BGN RON PLN CZK HUF HRK TRY XDR ILS EGP ZAR
+""".split())
+
+TR_DATE_RE = re.compile(r"\b(\d{2}/\d{2}/\d{4})\b")
+UPPER3_RE = re.compile(r"\b([A-Z]{3})\b")
+
+# Yerel yolda görmezden gelinen dolgu kelimeleri; bunlar dışında kalan her kelime LLM'e düşürür
+FILLER_WORDS = frozenset("""
+    ve and ile for için icin the of kur kurlar kurları kurlari kuru döviz doviz
+    indir getir download lütfen lutfen please rate rates rapor raporu report
+""".split())
+
+
+def _tr_date(d: datetime) -> str:
+    return d.strftime("%d/%m/%Y")
+
+
+def item_dates(item):
+    """Öğenin (start_dt, end_dt) aralığını döndürür; tarih eksik/geçersizse None."""
+    try:
+        s = datetime.strptime(item["start_date"], "%d/%m/%Y")
+        e = datetime.strptime(item["end_date"], "%d/%m/%Y")
+    except Exception:
+        return None
+    return (e, s) if s > e else (s, e)
+
+
+def _date_phrases(today: datetime):
+    """(regex, fn(match) -> (start, end)) çiftleri; tarih ifadeleri buradan tanınır."""
+    last_of_prev = today.replace(day=1) - timedelta(days=1)
+    return [
+        (r"geçen ay|gecen ay|last month|previous month",
+         lambda m: (last_of_prev.replace(day=1), last_of_prev)),
+        (r"bu ay|this month", lambda m: (today.replace(day=1), today)),
+        (r"(?:son|last)\s+(\d+)\s+(?:gün|gun|days?)",
+         lambda m: (today - timedelta(days=int(m.group(1))), today)),
+        (r"\bdün\b|\bdun\b|yesterday",
+         lambda m: (today - timedelta(days=1), today - timedelta(days=1))),
+        (r"\bbugün\b|\bbugun\b|today", lambda m: (today, today)),
+    ]
+
+
+def parse_batch_local(prompt_text: str, today: datetime = None):
+    """LLM'siz hızlı yol: 'EUR, USD, GBP, SEK geçen ay' gibi istekleri çözer.
+    Yalnızca her döviz ISO koduyla yazılmış ve tek bir tarih ifadesi varsa çalışır;
+    aksi halde None döner (tek LLM çağrısına düşülür)."""
+    today = today or datetime.now()
+    uppers = UPPER3_RE.findall(prompt_text)
+    if not uppers or any(c not in ISO_CODES for c in uppers):
+        return None
+    codes = list(dict.fromkeys(uppers))
+
+    rest = UPPER3_RE.sub(" ", prompt_text).lower()
+    dates = TR_DATE_RE.findall(rest)
+    rest = TR_DATE_RE.sub(" ", rest)
+    phrase_hits = []
+    for pattern, fn in _date_phrases(today):
+        phrase_hits += [fn(m) for m in re.finditer(pattern, rest)]
+        rest = re.sub(pattern, " ", rest)
+
+    # Tek tarih ifadesi olmalı; birden fazlaysa hangi kur hangi aralık, LLM eşlesin
+    if len(dates) > 2 or (dates and phrase_hits) or len(phrase_hits) > 1:
+        return None
+    if len(dates) == 2:
+        start, end = dates
+    elif len(dates) == 1:
+        start = end = dates[0]
+    elif phrase_hits:
+        start, end = map(_tr_date, phrase_hits[0])
+    else:
+        return None
+
+    # 31/02 gibi imkansız tarihler LLM'e bırakılır
+    if item_dates({"start_date": start, "end_date": end}) is None:
+        return None
+
+    # Tanınmayan kelime (ör. 'euro', 'dolar') kaldıysa bir döviz atlanmış olabilir
+    leftovers = [w for w in re.findall(r"\w+", rest) if w not in FILLER_WORDS]
+    if leftovers:
+        return None
+    return [{"currency": c, "start_date": start, "end_date": end} for c in codes]
+
+
+def match_currency_option(hint: str, options):
+    """Dropdown seçeneklerinden (dict: v, t) yalnızca ISO '(XXX)' veya birebir metin eşleşmesini kabul eder.
+    Bulamazsa None döner; belirsiz ipuçları LLM eşlemesine bırakılır."""
+    h = hint.strip()
+    if UPPER3_RE.fullmatch(h):
+        return next((o for o in options if f"({h})" in o["t"]), None)
+    hl = h.casefold()
+    return next((o for o in options if o["t"].casefold() == hl), None)
+
+
+def merge_ranges(items, key: str = "currency"):
+    """Aynı anahtar (döviz ya da dropdown value) için çakışan/bitişik tarih aralıklarını birleştirir.
+    Tarihi geçersiz öğeler atlanır (çağıran önceden item_dates ile ayıklayıp raporlamalı).
+    Dönüş: {key: [(start_dt, end_dt), ...]}"""
+    by_key = {}
+    for it in items:
+        rng = item_dates(it)
+        if rng is None:
+            continue
+        by_key.setdefault(str(it[key]).strip(), []).append(rng)
+
+    merged = {}
+    for k, ranges in by_key.items():
+        out = []
+        for s, e in sorted(ranges):
+            if out and s <= out[-1][1] + timedelta(days=1):
+                out[-1] = (out[-1][0], max(out[-1][1], e))
+            else:
+                out.append((s, e))
+        merged[k] = out
+    return merged
+
+
+def plan_submissions(merged):
+    """Form gönderimlerini tarihe göre sıralar; ardışık gönderimlerde yalnızca edit-kur-kod değişir."""
+    return sorted(((s, e, k) for k, ranges in merged.items() for s, e in ranges),
+                  key=lambda x: (x[0], x[1], x[2]))
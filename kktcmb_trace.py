@@ -0,0 +1,259 @@
+# kktcmb_trace.py
+# check_page.py'deki teşhisin (console / network hataları / ekran görüntüsü) worker içine
+# gömülü, düşük maliyetli hali. Her iş için istek zamanlamalarını halka tamponda tutar;
+# tam Playwright tracing'i yalnızca örneklenen veya yavaşlayan işlerde açar.
+# Not: yavaş işlerde tracing, SLOW_MS eşiği aşıldığı anda (aşamanın ortasında bile) başlar;
+# eşikten önceki kısım trace.zip'te yoktur ama waterfall.json'da istek/aşama süreleri vardır.
+import os
+import re
+import asyncio
+import json
+import time
+import uuid
+import random
+import shutil
+from collections import deque
+from contextlib import asynccontextmanager
+from datetime import datetime
+from pathlib import Path
+
+TRACE_DIR = Path(os.getenv("KKTCMB_TRACE_DIR", "./diag"))
+SAMPLE_RATE = float(os.getenv("KKTCMB_TRACE_SAMPLE", "0.05"))   # tam tracing açılacak işlerin oranı
+SLOW_MS = float(os.getenv("KKTCMB_SLOW_MS", "20000"))           # bu süreyi aşan iş "yavaş" sayılır
+RING_SIZE = int(os.getenv("KKTCMB_RING_SIZE", "300"))           # iş başına saklanan istek sayısı
+RECENT_JOBS = int(os.getenv("KKTCMB_RECENT_JOBS", "50"))        # bellekte tutulan son iş sayısı
+TRACE_KEEP = int(os.getenv("KKTCMB_TRACE_KEEP", "100"))         # diskte tutulan en fazla iş klasörü
+
+_RECENT = deque(maxlen=RECENT_JOBS)
+
+
+def _span(t: dict, a: str, b: str):
+    """Playwright timing alanları -1 ise ölçüm yok demektir."""
+    x, y = t.get(a, -1), t.get(b, -1)
+    if x is None or y is None or x < 0 or y < 0:
+        return None
+    return round(y - x, 1)
+
+
+JOB_ID_RE = re.compile(r"[0-9a-f]{12}")
+
+
+def _prune_trace_dir(keep: int = TRACE_KEEP):
+    """En yeni `keep` iş klasörü dışındakileri siler; disk sınırsız dolmasın.
+    Yalnızca bizim yazdığımız klasörlere (job-id adı + waterfall.json) dokunur."""
+    try:
+        dirs = sorted((d for d in TRACE_DIR.iterdir()
+                       if d.is_dir() and JOB_ID_RE.fullmatch(d.name) and (d / "waterfall.json").is_file()),
+                      key=lambda d: d.stat().st_mtime, reverse=True)
+    except Exception:
+        return
+    for d in dirs[keep:]:
+        shutil.rmtree(d, ignore_errors=True)
+
+
+def _pct(values, q: float):
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(q * len(values)))], 1)
+
+
+class JobRecorder:
+    """Tek bir run_kktcmb çağrısının waterfall + aşama süreleri + hata kaydı."""
+
+    def __init__(self):
+        self.job_id = uuid.uuid4().hex[:12]
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self.t0 = time.perf_counter()
+        self.epoch0_ms = time.time() * 1000
+        self.requests = deque(maxlen=RING_SIZE)
+        self.failures = deque(maxlen=RING_SIZE)
+        self.stages = []
+        self.sampled = random.random() < SAMPLE_RATE
+        self.trace_reason = None
+        self.error = None
+        self.finished = False
+        self._job = None
+        self._watchdog = None
+        self._ctx = None
+        self._stage = None
+        self._status = {}
+
+    def elapsed_ms(self) -> float:
+        return round((time.perf_counter() - self.t0) * 1000, 1)
+
+    # ---- Playwright bağlantısı ----
+    async def attach(self, ctx, page):
+        self._ctx = ctx
+        ctx.on("response", self._on_response)
+        ctx.on("requestfinished", self._on_finished)
+        ctx.on("requestfailed", self._on_failed)
+        page.on("console", self._on_console)
+        page.on("pageerror", lambda e: self._fail("pageerror", str(e)))
+        if self.sampled:
+            await self._start_tracing("sampled")
+        else:
+            self._watchdog = asyncio.create_task(self._arm_when_slow())
+
+    async def _arm_when_slow(self):
+        # Eşik, uzun süren aşamanın (ör. 60 sn'lik goto) içinde aşılsa da tracing o anda başlar
+        await asyncio.sleep(max(0.0, SLOW_MS - self.elapsed_ms()) / 1000)
+        await self._start_tracing("slow")
+
+    async def _start_tracing(self, reason: str):
+        if self.trace_reason or self._ctx is None:
+            return
+        try:
+            await self._ctx.tracing.start(screenshots=True, snapshots=True)
+            self.trace_reason = reason
+        except Exception:
+            pass
+
+    def _fail(self, kind: str, msg: str, url: str = None):
+        self.failures.append({
+            "kind": kind, "msg": (msg or "")[:500], "url": url,
+            "stage": self._stage, "at_ms": self.elapsed_ms(),
+        })
+
+    def _on_console(self, msg):
+        if msg.type in ("error", "warning"):
+            self._fail(f"console.{msg.type}", msg.text)
+
+    def _on_response(self, response):
+        self._status[response.request] = response.status
+
+    def _on_failed(self, request):
+        self._status.pop(request, None)
+        self._fail("requestfailed", str(request.failure), request.url[:300])
+
+    async def _on_finished(self, request):
+        status = self._status.pop(request, None)
+        t = request.timing or {}
+        try:
+            size = (await request.sizes()).get("responseBodySize")
+        except Exception:
+            size = None
+        start = t.get("startTime")
+        end = t.get("responseEnd", -1)
+        self.requests.append({
+            "url": request.url[:300],
+            "method": request.method,
+            "type": request.resource_type,
+            "status": status,
+            "stage": self._stage,
+            "start_ms": round(start - self.epoch0_ms, 1) if start else None,
+            "dns_ms": _span(t, "domainLookupStart", "domainLookupEnd"),
+            "connect_ms": _span(t, "connectStart", "connectEnd"),
+            "ttfb_ms": _span(t, "requestStart", "responseStart"),
+            "total_ms": round(end, 1) if end is not None and end >= 0 else None,
+            "size": size,
+        })
+
+    # ---- Aşamalar ----
+    @asynccontextmanager
+    async def stage(self, name: str, **info):
+        prev, self._stage = self._stage, name
+        start = self.elapsed_ms()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.stages.append({"name": name, "start_ms": start,
+                                "duration_ms": round(self.elapsed_ms() - start, 1), "ok": ok, **info})
+            self._stage = prev
+
+    # ---- Kapanış ----
+    def _stage_totals(self) -> dict:
+        # İş başına toplam (ör. tüm batch_submit'ler); yüzdelikler stage_list'teki tekil kayıtlardan hesaplanır
+        totals = {}
+        for s in self.stages:
+            totals[s["name"]] = round(totals.get(s["name"], 0) + s["duration_ms"], 1)
+        return totals
+
+    def summary(self) -> dict:
+        slowest = sorted((r for r in self.requests if r["total_ms"] is not None),
+                         key=lambda r: r["total_ms"], reverse=True)[:5]
+        return {
+            "job_id": self.job_id,
+            "started_at": self.started_at,
+            "duration_ms": self.elapsed_ms(),
+            "slow": self.elapsed_ms() > SLOW_MS,
+            "trace": self.trace_reason,
+            "error": self.error,
+            "stage_totals": self._stage_totals(),
+            "request_count": len(self.requests),
+            "failure_count": len(self.failures),
+            "slowest": [{"url": r["url"], "total_ms": r["total_ms"], "stage": r["stage"]} for r in slowest],
+        }
+
+    async def finish(self, page=None, error: Exception = None):
+        """Tracing'i kapatır; yavaş/örneklenen/hatalı işlerin artefaktlarını diske yazar. Asla hata fırlatmaz.
+        İkinci çağrı bir şey yapmaz, ilk kaydı döndürür."""
+        if self.finished:
+            return self._job
+        self.finished = True
+        if self._watchdog:
+            self._watchdog.cancel()
+        self.error = str(error) if error else None
+        job = {**self.summary(), "stage_list": self.stages,
+               "requests": list(self.requests), "failures": list(self.failures)}
+        keep = bool(self.trace_reason or job["slow"] or error)
+        if keep:
+            out = TRACE_DIR / self.job_id
+            try:
+                out.mkdir(parents=True, exist_ok=True)
+                if self.trace_reason:
+                    await self._ctx.tracing.stop(path=out / "trace.zip")
+                    job["trace_zip"] = True
+            except Exception:
+                pass
+            try:
+                if page is not None:
+                    await page.screenshot(path=out / "last.png", full_page=True)
+            except Exception:
+                pass
+            try:
+                (out / "waterfall.json").write_text(json.dumps(job, ensure_ascii=False), encoding="utf-8")
+            except Exception:
+                pass
+            _prune_trace_dir()
+        _RECENT.append(job)
+        self._job = job
+        return job
+
+
+# ---- app.py için okuma yardımcıları ----
+def list_jobs() -> dict:
+    jobs = list(_RECENT)
+    # Aşama yüzdelikleri tekil kayıtlardan: 10 kurluk bir batch, daha çok gönderimi var diye "yavaş" görünmesin
+    by_stage = {}
+    for j in jobs:
+        for s in j.get("stage_list", []):
+            by_stage.setdefault(s["name"], []).append(s["duration_ms"])
+    durations = [j["duration_ms"] for j in jobs]
+    return {
+        "p50_ms": _pct(durations, 0.5),
+        "p95_ms": _pct(durations, 0.95),
+        "stages": {
+            n: {"count": len(v), "p50_ms": _pct(v, 0.5), "p95_ms": _pct(v, 0.95)}
+            for n, v in sorted(by_stage.items())
+        },
+        "jobs": [{k: v for k, v in j.items() if k not in ("stage_list", "requests", "failures")}
+                 for j in reversed(jobs)],
+    }
+
+
+def get_job(job_id: str):
+    for j in _RECENT:
+        if j["job_id"] == job_id:
+            return j
+    f = TRACE_DIR / job_id / "waterfall.json"
+    if f.exists():
+        return json.loads(f.read_text(encoding="utf-8"))
+    return None
+
+
+def trace_zip_path(job_id: str):
+    f = TRACE_DIR / job_id / "trace.zip"
+    return f if f.exists() else None
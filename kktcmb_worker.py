@@ -9,6 +9,9 @@ from dotenv import load_dotenv
 from openai import OpenAI
 from playwright.async_api import async_playwright
 
+from kktcmb_batch import parse_batch_local, item_dates, match_currency_option, merge_ranges, plan_submissions
+from kktcmb_trace import JobRecorder
+
 load_dotenv()
 client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
 
@@ -126,23 +129,41 @@ async def _type_into(page, locator_str: str, value: str):
     return True
 
 
+DATE_START_SELECTORS = [
+    "input[name*=Baslangic]", "#BaslangicTarihi", "#edit-baslangic-tarihi",
+    "input[name='baslangic_tarihi']", "input[placeholder*='Başlangıç']",
+    "input[name*=start]", "input[name*=Start]",
+    "input.hasDatepicker >> nth=0", "input[type='text'] >> nth=0",
+]
+DATE_END_SELECTORS = [
+    "input[name*=Bitis]", "#BitisTarihi", "#edit-bitis-tarihi",
+    "input[name='bitis_tarihi']", "input[placeholder*='Bitiş']",
+    "input[name*=end]", "input[name*=End]",
+    "input.hasDatepicker >> nth=1", "input[type='text'] >> nth=1",
+]
+
+
+async def read_dates(page):
+    """Ekrandaki (başlangıç, bitiş) tarih değerlerini okur; bulunamayan alan için None."""
+    async def first_value(sel_list):
+        for q in sel_list:
+            try:
+                loc = page.locator(q).first
+                if await loc.count():
+                    return await loc.input_value(timeout=1000)
+            except Exception:
+                continue
+        return None
+    return await first_value(DATE_START_SELECTORS), await first_value(DATE_END_SELECTORS)
+
+
 async def set_dates_resilient(page, start_dt: datetime, end_dt: datetime, send_log):
     """datepicker/readonly/gizli alan fark etmeksizin tarihleri gerçekten uygular."""
     start_str = tr_date(start_dt)
     end_str = tr_date(end_dt)
 
-    candidates_start = [
-        "input[name*=Baslangic]", "#BaslangicTarihi", "#edit-baslangic-tarihi",
-        "input[name='baslangic_tarihi']", "input[placeholder*='Başlangıç']",
-        "input[name*=start]", "input[name*=Start]",
-        "input.hasDatepicker >> nth=0", "input[type='text'] >> nth=0",
-    ]
-    candidates_end = [
-        "input[name*=Bitis]", "#BitisTarihi", "#edit-bitis-tarihi",
-        "input[name='bitis_tarihi']", "input[placeholder*='Bitiş']",
-        "input[name*=end]", "input[name*=End]",
-        "input.hasDatepicker >> nth=1", "input[type='text'] >> nth=1",
-    ]
+    candidates_start = DATE_START_SELECTORS
+    candidates_end = DATE_END_SELECTORS
 
     wrote = False
     # 1) klavye yöntemi
@@ -209,21 +230,8 @@ async def set_dates_resilient(page, start_dt: datetime, end_dt: datetime, send_l
 
     # 3) doğrulama: input_value() gerçekten bizim yazdığımız mı?
     # (bulabildiğimiz ilk eşleşen iki input’tan kontrol)
-    def read_back(sel_list):
-        for q in sel_list:
-            try:
-                val = page.locator(q).first.input_value()
-                return val
-            except Exception:
-                continue
-        return None
-
-    try:
-        s_val = await read_back(candidates_start)
-        e_val = await read_back(candidates_end)
-        await send_safe(send_log, f"🔎 Ekrandaki değerler: {s_val} → {e_val}")
-    except Exception:
-        s_val = e_val = None
+    s_val, e_val = await read_dates(page)
+    await send_safe(send_log, f"🔎 Ekrandaki değerler: {s_val} → {e_val}")
 
     # 4) hâlâ ekran varsayılanı görünüyorsa kullanıcıyı uyar ama devam et
     if (s_val and s_val != start_str) or (e_val and e_val != end_str):
@@ -232,7 +240,26 @@ async def set_dates_resilient(page, start_dt: datetime, end_dt: datetime, send_l
     return wrote
 
 
+async def finish_job(rec, send_log, page=None, error=None):
+    """Teşhis kaydını bir kez kapatır; diske yazıldıysa /traces yolunu loglar."""
+    if rec.finished:
+        return
+    job = await rec.finish(page, error)
+    if job.get("trace") or job.get("slow") or error:
+        await send_safe(send_log, f"🧾 Teşhis kaydı: /traces/{rec.job_id} ({job['duration_ms']:.0f} ms)")
+
+
 async def run_kktcmb(prompt_text: str, send_log):
+    # LLM / tarayıcı açılışı sırasındaki hatalar da /traces'te görünsün
+    rec = JobRecorder()
+    try:
+        return await _run_kktcmb(rec, prompt_text, send_log)
+    except Exception as e:
+        await finish_job(rec, send_log, error=e)
+        raise
+
+
+async def _run_kktcmb(rec, prompt_text: str, send_log):
     await send_safe(send_log, f"💬 Prompt: {prompt_text}")
 
     # — intent + tarih + kur extraction —
@@ -247,11 +274,12 @@ async def run_kktcmb(prompt_text: str, send_log):
     )
     user = f'Kullanıcı mesajı: """{prompt_text}"""'
 
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",
-        temperature=0,
-        messages=[{"role": "system", "content": sys}, {"role": "user", "content": user}],
-    )
+    async with rec.stage("extract"):
+        resp = client.chat.completions.create(
+            model="gpt-4o-mini",
+            temperature=0,
+            messages=[{"role": "system", "content": sys}, {"role": "user", "content": user}],
+        )
     raw = resp.choices[0].message.content
     data = parse_json_relaxed(raw)
 
@@ -277,47 +305,256 @@ async def run_kktcmb(prompt_text: str, send_log):
         browser = await p.chromium.launch(headless=True, args=["--lang=tr-TR"])
         ctx = await browser.new_context(locale="tr-TR", accept_downloads=True, ignore_https_errors=True)
         page = await ctx.new_page()
+        await rec.attach(ctx, page)
 
-        await send_safe(send_log, "🌐 Sayfaya gidiliyor…")
-        await page.goto(URL, wait_until="domcontentloaded", timeout=120_000)
-        await close_cookies(page, send_log)
+        error = None
+        try:
+            await send_safe(send_log, "🌐 Sayfaya gidiliyor…")
+            async with rec.stage("goto"):
+                await page.goto(URL, wait_until="domcontentloaded", timeout=120_000)
+                await close_cookies(page, send_log)
+
+            # A) tüm kurlar (mode: all/both)
+            if mode in ["all", "both"]:
+                await send_safe(send_log, "➡️ Tarih Bazında Kur Sorgulama (Tüm kurlar)")
+                async with rec.stage("all_download"):
+                    await page.click("text=Tarih Bazında Kur Sorgulama")
+                    async with page.expect_download(timeout=20000) as d1:
+                        await page.click("text=EXCEL İndir")
+                    d1 = await d1.value
+                    f1 = OUT_DIR / d1.suggested_filename
+                    await d1.save_as(f1)
+                await send_safe(send_log, f"✅ Tüm kurlar Downloads klasörüne indirildi: {f1.name}")
+
+            # B) tek kur (mode: single/both)
+            if mode in ["single", "both"]:
+                await send_safe(send_log, "➡️ Döviz Cinsi Bazında Kur Sorgulama (tek kur)")
+                async with rec.stage("single_form"):
+                    await page.click("text=Döviz Cinsi Bazında Kur Sorgulama")
+
+                    ok_dates = await set_dates_resilient(page, start_date, end_date, send_log)
+                    if not ok_dates:
+                        await send_safe(send_log, "⚠️ Tarihler güvence altına alınamadı; yine de devam ediyorum.")
+
+                    await select_currency_llm(page, currency_hint, send_log)
+
+                async with rec.stage("single_list"):
+                    try:
+                        await page.click("text=Listele", timeout=6000)
+                    except Exception:
+                        await send_safe(send_log, "ℹ️ 'Listele' görünmüyor, tablo yüklü olabilir.")
+
+                async with rec.stage("single_download"):
+                    async with page.expect_download(timeout=25000) as d2:
+                        await page.click("text=EXCEL İndir")
+                    d2 = await d2.value
+                    f2 = OUT_DIR / d2.suggested_filename
+                    await d2.save_as(f2)
+                await send_safe(send_log, f"✅ Tek kur Downloads klasörüne indirildi: {f2.name}")
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            await finish_job(rec, send_log, page, error)
+            await ctx.close()
+            await browser.close()
 
-        # A) tüm kurlar (mode: all/both)
-        if mode in ["all", "both"]:
-            await send_safe(send_log, "➡️ Tarih Bazında Kur Sorgulama (Tüm kurlar)")
-            await page.click("text=Tarih Bazında Kur Sorgulama")
-            async with page.expect_download(timeout=20000) as d1:
-                await page.click("text=EXCEL İndir")
-            d1 = await d1.value
-            f1 = OUT_DIR / d1.suggested_filename
-            await d1.save_as(f1)
-            await send_safe(send_log, f"✅ Tüm kurlar Downloads klasörüne indirildi: {f1.name}")
+    await send_safe(send_log, "🎉 İşlem tamamlandı.")
+    return {"mode": mode, "start_date": tr_date(start_date), "end_date": tr_date(end_date), "currency": currency_hint,
+            "job_id": rec.job_id}
 
-        # B) tek kur (mode: single/both)
-        if mode in ["single", "both"]:
-            await send_safe(send_log, "➡️ Döviz Cinsi Bazında Kur Sorgulama (tek kur)")
-            await page.click("text=Döviz Cinsi Bazında Kur Sorgulama")
 
-            ok_dates = await set_dates_resilient(page, start_date, end_date, send_log)
-            if not ok_dates:
-                await send_safe(send_log, "⚠️ Tarihler güvence altına alınamadı; yine de devam ediyorum.")
+# ---- Toplu (batch) sorgu ----
+async def extract_batch_intents(prompt_text: str, send_log):
+    """Tüm istekleri tek seferde çıkarır: önce yerel parser, olmazsa tek bir LLM çağrısı."""
+    items = parse_batch_local(prompt_text)
+    if items:
+        await send_safe(send_log, f"⚡ Yerel parser ile çıkarıldı: {items}")
+        return items
 
-            await select_currency_llm(page, currency_hint, send_log)
+    today_str = tr_date(datetime.now())
+    sys = (
+        "You are an intelligent extractor for currency report automation.\n"
+        "The user may ask for several currencies and/or several date ranges in one message.\n"
+        "Return one item per (currency, date range) pair.\n"
+        f"Dates in dd/MM/yyyy (handle Turkish: 'bugün','dün','son 3 gün','geçen ay'). Today is {today_str}.\n"
+        "Currency: ISO code if you know it (e.g. EUR, USD, SEK), otherwise the user's wording.\n"
+        'ALWAYS output STRICT JSON: {"items": [{"currency": ..., "start_date": ..., "end_date": ...}]}'
+    )
+    user = f'Kullanıcı mesajı: """{prompt_text}"""'
+    resp = client.chat.completions.create(
+        model="gpt-4o-mini",
+        temperature=0,
+        messages=[{"role": "system", "content": sys}, {"role": "user", "content": user}],
+    )
+    data = parse_json_relaxed(resp.choices[0].message.content) or {}
+    items = [
+        i for i in (data.get("items") or [])
+        if isinstance(i, dict) and isinstance(i.get("currency"), str) and i["currency"].strip()
+        and isinstance(i.get("start_date"), str) and isinstance(i.get("end_date"), str)
+    ]
+    await send_safe(send_log, f"📦 LLM ile çıkarıldı: {items}")
+    return items
 
-            try:
-                await page.click("text=Listele", timeout=6000)
-            except Exception:
-                await send_safe(send_log, "ℹ️ 'Listele' görünmüyor, tablo yüklü olabilir.")
 
-            async with page.expect_download(timeout=25000) as d2:
-                await page.click("text=EXCEL İndir")
-            d2 = await d2.value
-            f2 = OUT_DIR / d2.suggested_filename
-            await d2.save_as(f2)
-            await send_safe(send_log, f"✅ Tek kur Downloads klasörüne indirildi: {f2.name}")
+async def resolve_currency_values(page, hints, send_log):
+    """Her ipucunu dropdown seçeneğine eşler: ISO/birebir eşleşme, kalanlar için tek LLM çağrısı.
+    Dönüş: {hint: {"v": value, "t": label}}; eşlenemeyen ipucu sonuçta yer almaz."""
+    sel = "select#edit-kur-kod"
+    await page.locator(sel).wait_for(state="visible", timeout=5000)
+    options = await page.locator(f"{sel} option").evaluate_all(
+        "els => els.map(e => ({v:e.value,t:(e.textContent||'').trim()}))"
+    )
+    options = [o for o in options if o["v"]]
+
+    resolved, pending = {}, []
+    for h in hints:
+        hit = match_currency_option(h, options)
+        if hit:
+            resolved[h] = hit
+        else:
+            pending.append(h)
+
+    if pending:
+        sys = ("You are a precise extraction assistant. Map each user currency hint to exactly one item "
+               "from the list of official currency display names. If a hint is not a currency or matches "
+               "none of the items, map it to null. Return STRICT JSON object {hint: list item or null}.")
+        user = f"Hints: {pending}\nList: {[o['t'] for o in options]}"
+        resp = client.chat.completions.create(
+            model="gpt-4o-mini",
+            temperature=0,
+            messages=[{"role": "system", "content": sys}, {"role": "user", "content": user}],
+        )
+        mapping = parse_json_relaxed(resp.choices[0].message.content) or {}
+        for h in pending:
+            hit = next((o for o in options if o["t"] == (mapping.get(h) or "").strip()), None)
+            if hit:
+                resolved[h] = hit
+
+    await send_safe(send_log, f"🎯 Kur eşleşmeleri: { {h: o['t'] for h, o in resolved.items()} }")
+    return resolved
+
+
+async def run_kktcmb_batch(prompt_text: str, send_log, send_result=None):
+    """Birden çok kur/tarih isteğini tek sayfada, en az form gönderimiyle indirir.
+    Her indirme bittikçe send_result(dict) ile akıtılır."""
+    rec = JobRecorder()
+    try:
+        return await _run_kktcmb_batch(rec, prompt_text, send_log, send_result)
+    except Exception as e:
+        await finish_job(rec, send_log, error=e)
+        raise
+
+
+async def _run_kktcmb_batch(rec, prompt_text: str, send_log, send_result=None):
+    await send_safe(send_log, f"💬 Toplu prompt: {prompt_text}")
+
+    async with rec.stage("extract"):
+        items = await extract_batch_intents(prompt_text, send_log)
+    if not items:
+        raise RuntimeError("İstekten döviz/tarih çıkarılamadı.")
+
+    results = []
+    plan = []
+
+    async def emit(res):
+        results.append(res)
+        if send_result:
+            await send_safe(send_result, res)
+
+    # Geçersiz tarihli öğeler varsayılan aralıkla indirilmez; hata olarak raporlanır
+    valid_items = []
+    for it in items:
+        if item_dates(it):
+            valid_items.append(it)
+        else:
+            await send_safe(send_log, f"⚠️ {it['currency']}: geçersiz tarih ({it['start_date']} → {it['end_date']})")
+            await emit({"currency": it["currency"], "start_date": it["start_date"],
+                        "end_date": it["end_date"], "error": "geçersiz tarih"})
+    items = valid_items
+    if not items:
+        raise RuntimeError("Geçerli tarihli istek bulunamadı.")
 
-        await ctx.close()
-        await browser.close()
+    async with async_playwright() as p:
+        browser = await p.chromium.launch(headless=True, args=["--lang=tr-TR"])
+        ctx = await browser.new_context(locale="tr-TR", accept_downloads=True, ignore_https_errors=True)
+        page = await ctx.new_page()
+        await rec.attach(ctx, page)
 
-    await send_safe(send_log, "🎉 İşlem tamamlandı.")
-    return {"mode": mode, "start_date": tr_date(start_date), "end_date": tr_date(end_date), "currency": currency_hint}
+        error = None
+        try:
+            await send_safe(send_log, "🌐 Sayfaya gidiliyor…")
+            async with rec.stage("goto"):
+                await page.goto(URL, wait_until="domcontentloaded", timeout=120_000)
+                await close_cookies(page, send_log)
+
+            async with rec.stage("batch_resolve"):
+                await page.click("text=Döviz Cinsi Bazında Kur Sorgulama")
+                values = await resolve_currency_values(
+                    page, list(dict.fromkeys(i["currency"].strip() for i in items)), send_log)
+
+            # Birleştirme ipucuna göre değil dropdown value'suna göre: 'EUR' ve 'euro' tek gönderim olur
+            resolved_items = []
+            for it in items:
+                opt = values.get(it["currency"].strip())
+                if opt:
+                    resolved_items.append({**it, "value": opt["v"]})
+                else:
+                    await send_safe(send_log, f"⚠️ {it['currency']}: dropdown'da eşleşme bulunamadı")
+                    await emit({"currency": it["currency"], "start_date": it.get("start_date"),
+                                "end_date": it.get("end_date"), "error": "dropdown'da eşleşme bulunamadı"})
+            labels = {o["v"]: o["t"] for o in values.values()}
+
+            plan = plan_submissions(merge_ranges(resolved_items, key="value"))
+            await send_safe(send_log, f"🗂️ {len(items)} istek → {len(plan)} form gönderimi: "
+                                      f"{[(labels[v], tr_date(s), tr_date(e)) for s, e, v in plan]}")
+
+            for start_dt, end_dt, value in plan:
+                label = labels[value]
+                res = {"currency": label, "start_date": tr_date(start_dt), "end_date": tr_date(end_dt)}
+                try:
+                    async with rec.stage("batch_submit", currency=label, value=value):
+                        # Form submit sonrası sekme kapandıysa yeniden aç
+                        if not await page.locator("select#edit-kur-kod").is_visible():
+                            await page.click("text=Döviz Cinsi Bazında Kur Sorgulama")
+                        # Sayfa yeniden yüklenip tarihler sıfırlanmış olabilir: ekrandakini oku
+                        if await read_dates(page) != (res["start_date"], res["end_date"]):
+                            ok_dates = await set_dates_resilient(page, start_dt, end_dt, send_log)
+                            if not ok_dates:
+                                await send_safe(send_log, "⚠️ Tarihler güvence altına alınamadı; yine de devam ediyorum.")
+                        await page.locator("select#edit-kur-kod").select_option(value=value)
+
+                        try:
+                            await page.click("text=Listele", timeout=6000)
+                        except Exception:
+                            await send_safe(send_log, "ℹ️ 'Listele' görünmüyor, tablo yüklü olabilir.")
+
+                        async with page.expect_download(timeout=25000) as dl:
+                            await page.click("text=EXCEL İndir")
+                        dl = await dl.value
+                        target = OUT_DIR / (f"{start_dt:%Y%m%d}-{end_dt:%Y%m%d}_"
+                                            f"{value}_{dl.suggested_filename or 'kur.xlsx'}")
+                        await dl.save_as(target)
+                    res["file"] = target.name
+                    await send_safe(send_log, f"✅ {label} indirildi: {target.name}")
+                except Exception as e:
+                    res["error"] = str(e)
+                    await send_safe(send_log, f"⚠️ {label} indirilemedi: {e}")
+                await emit(res)
+        except Exception as e:
+            error = e
+            raise
+        finally:
+            await finish_job(rec, send_log, page, error)
+            await ctx.close()
+            await browser.close()
+
+    await send_safe(send_log, "🎉 Toplu işlem tamamlandı.")
+    return {
+        "mode": "batch",
+        "start_date": tr_date(min(s for s, _, _ in plan)) if plan else None,
+        "end_date": tr_date(max(e for _, e, _ in plan)) if plan else None,
+        "currency": ", ".join(dict.fromkeys(r["currency"] for r in results)),
+        "results": results,
+        "job_id": rec.job_id,
+    }
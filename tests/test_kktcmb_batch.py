@@ -0,0 +1,101 @@
+from datetime import datetime
+
+from kktcmb_batch import item_dates, match_currency_option, merge_ranges, parse_batch_local, plan_submissions
+
+TODAY = datetime(2026, 10, 19)
+
+OPTIONS = [
+    {"v": "1", "t": "ABD Doları (USD)"},
+    {"v": "2", "t": "Avro (EUR)"},
+    {"v": "3", "t": "Kanada Doları (CAD)"},
+    {"v": "4", "t": "İsveç Kronu (SEK)"},
+    {"v": "5", "t": "Norveç Kronu (NOK)"},
+]
+
+
+def test_local_parser_iso_codes_last_month():
+    items = parse_batch_local("EUR, USD, GBP, SEK for last month", TODAY)
+    assert [i["currency"] for i in items] == ["EUR", "USD", "GBP", "SEK"]
+    assert all(i["start_date"] == "01/09/2026" and i["end_date"] == "30/09/2026" for i in items)
+
+
+def test_local_parser_last_n_days():
+    assert parse_batch_local("EUR ve USD son 7 gün", TODAY) == [
+        {"currency": "EUR", "start_date": "12/10/2026", "end_date": "19/10/2026"},
+        {"currency": "USD", "start_date": "12/10/2026", "end_date": "19/10/2026"},
+    ]
+
+
+def test_local_parser_defers_non_iso_currency_to_llm():
+    assert parse_batch_local("euro ve USD geçen ay", TODAY) is None
+
+
+def test_local_parser_defers_multiple_date_ranges_to_llm():
+    assert parse_batch_local("EUR 01/01/2025 31/01/2025, USD 01/02/2025 28/02/2025", TODAY) is None
+    assert parse_batch_local("EUR geçen ay, USD son 3 gün", TODAY) is None
+
+
+def test_local_parser_rejects_non_iso_uppercase_words():
+    assert parse_batch_local("SON 3 GÜN EUR", TODAY) is None
+    assert parse_batch_local("EUR, USD son 7 gün XLS olarak", TODAY) is None
+
+
+def test_local_parser_needs_a_date_expression():
+    assert parse_batch_local("EUR USD", TODAY) is None
+
+
+def test_local_parser_defers_impossible_dates_to_llm():
+    assert parse_batch_local("EUR USD 01/09/2026 31/02/2026", TODAY) is None
+
+
+def test_item_dates_rejects_invalid():
+    assert item_dates({"start_date": "2026-09-01", "end_date": "30/09/2026"}) is None
+    assert item_dates({"start_date": "31/02/2026", "end_date": "01/03/2026"}) is None
+    assert item_dates({"start_date": "30/09/2026", "end_date": "01/09/2026"}) == (
+        datetime(2026, 9, 1), datetime(2026, 9, 30))
+
+
+def test_match_currency_option_only_iso_or_exact():
+    assert match_currency_option("SEK", OPTIONS)["v"] == "4"
+    assert match_currency_option("avro (eur)", OPTIONS)["v"] == "2"
+    assert match_currency_option("dolar", OPTIONS) is None
+    assert match_currency_option("kron", OPTIONS) is None
+    assert match_currency_option("XLS", OPTIONS) is None
+
+
+def test_merge_ranges_overlapping_and_adjacent():
+    merged = merge_ranges([
+        {"currency": "EUR", "start_date": "01/09/2026", "end_date": "10/09/2026"},
+        {"currency": "EUR", "start_date": "11/09/2026", "end_date": "20/09/2026"},
+        {"currency": "EUR", "start_date": "25/09/2026", "end_date": "30/09/2026"},
+    ])
+    assert merged == {"EUR": [(datetime(2026, 9, 1), datetime(2026, 9, 20)),
+                              (datetime(2026, 9, 25), datetime(2026, 9, 30))]}
+
+
+def test_merge_ranges_drops_invalid_dates():
+    merged = merge_ranges([
+        {"currency": "EUR", "start_date": "01/09/2026", "end_date": "31/02/2026"},
+        {"currency": "USD", "start_date": "01/09/2026", "end_date": "30/09/2026"},
+    ])
+    assert merged == {"USD": [(datetime(2026, 9, 1), datetime(2026, 9, 30))]}
+
+
+def test_merge_ranges_by_dropdown_value():
+    # 'EUR' ve 'euro' aynı dropdown value'suna çözülünce tek aralık olur
+    merged = merge_ranges([
+        {"currency": "EUR", "value": "2", "start_date": "01/09/2026", "end_date": "15/09/2026"},
+        {"currency": "euro", "value": "2", "start_date": "10/09/2026", "end_date": "30/09/2026"},
+    ], key="value")
+    assert merged == {"2": [(datetime(2026, 9, 1), datetime(2026, 9, 30))]}
+
+
+def test_plan_submissions_groups_same_range():
+    merged = {
+        "USD": [(datetime(2026, 9, 1), datetime(2026, 9, 30))],
+        "EUR": [(datetime(2026, 9, 1), datetime(2026, 9, 30)), (datetime(2026, 10, 1), datetime(2026, 10, 5))],
+        "SEK": [(datetime(2026, 9, 1), datetime(2026, 9, 30))],
+    }
+    plan = plan_submissions(merged)
+    assert [c for _, _, c in plan] == ["EUR", "SEK", "USD", "EUR"]
+    assert len({(s, e) for s, e, _ in plan[:3]}) == 1
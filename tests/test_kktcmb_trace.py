@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import pytest
+
+import kktcmb_trace
+from kktcmb_trace import JobRecorder, _pct, _prune_trace_dir, _span, get_job, list_jobs
+
+
+class FakeTracing:
+    def __init__(self):
+        self.started = False
+
+    async def start(self, **kw):
+        self.started = True
+
+    async def stop(self, path):
+        path.write_bytes(b"zip")
+
+
+class FakeCtx:
+    def __init__(self):
+        self.tracing = FakeTracing()
+
+    def on(self, event, handler):
+        pass
+
+
+class FakePage:
+    def on(self, event, handler):
+        pass
+
+    async def screenshot(self, path, full_page):
+        path.write_bytes(b"png")
+
+
+@pytest.fixture(autouse=True)
+def trace_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(kktcmb_trace, "TRACE_DIR", tmp_path)
+    monkeypatch.setattr(kktcmb_trace, "_RECENT", kktcmb_trace.deque(maxlen=10))
+    monkeypatch.setattr(kktcmb_trace, "SAMPLE_RATE", 0.0)
+    return tmp_path
+
+
+def run(coro):
+    return asyncio.run(coro)
+
+
+def test_span_and_pct():
+    t = {"domainLookupStart": 1.0, "domainLookupEnd": 3.5, "connectStart": -1, "connectEnd": 4.0}
+    assert _span(t, "domainLookupStart", "domainLookupEnd") == 2.5
+    assert _span(t, "connectStart", "connectEnd") is None
+    assert _span(t, "requestStart", "responseStart") is None
+    assert _pct([], 0.5) is None
+    assert _pct([30, 10, 20], 0.5) == 20
+    assert _pct(list(range(1, 101)), 0.95) == 96
+
+
+def test_stage_records_info_and_totals():
+    async def go():
+        rec = JobRecorder()
+        for cur in ("EUR", "USD"):
+            async with rec.stage("batch_submit", currency=cur):
+                pass
+        with pytest.raises(RuntimeError):
+            async with rec.stage("goto"):
+                raise RuntimeError("boom")
+        return rec
+
+    rec = run(go())
+    assert [s["currency"] for s in rec.stages if s["name"] == "batch_submit"] == ["EUR", "USD"]
+    assert rec.stages[-1]["name"] == "goto" and rec.stages[-1]["ok"] is False
+    assert set(rec.summary()["stage_totals"]) == {"batch_submit", "goto"}
+
+
+def test_finish_fast_job_stays_in_memory_only(trace_dir):
+    rec = JobRecorder()
+    job = run(rec.finish())
+    assert job["slow"] is False and not list(trace_dir.iterdir())
+    assert get_job(rec.job_id)["job_id"] == rec.job_id
+    # ikinci çağrı aynı kaydı döndürür, tekrar eklemez
+    assert run(rec.finish(error=RuntimeError("x"))) is job
+    assert len(list_jobs()["jobs"]) == 1
+
+
+def test_finish_error_job_writes_artifacts(trace_dir):
+    rec = JobRecorder()
+    run(rec.finish(FakePage(), RuntimeError("boom")))
+    out = trace_dir / rec.job_id
+    assert (out / "last.png").exists()
+    assert json.loads((out / "waterfall.json").read_text(encoding="utf-8"))["error"] == "boom"
+
+
+def test_finish_sampled_job_writes_trace_zip(trace_dir, monkeypatch):
+    monkeypatch.setattr(kktcmb_trace, "SAMPLE_RATE", 1.0)
+
+    async def go():
+        rec = JobRecorder()
+        await rec.attach(FakeCtx(), FakePage())
+        return rec, await rec.finish()
+
+    rec, job = run(go())
+    assert job["trace"] == "sampled" and job["trace_zip"] is True
+    assert (trace_dir / rec.job_id / "trace.zip").exists()
+
+
+def test_slow_watchdog_starts_tracing_mid_stage(monkeypatch):
+    monkeypatch.setattr(kktcmb_trace, "SLOW_MS", 10)
+
+    async def go():
+        rec = JobRecorder()
+        ctx = FakeCtx()
+        await rec.attach(ctx, FakePage())
+        async with rec.stage("goto"):
+            await asyncio.sleep(0.05)
+            started = ctx.tracing.started
+        await rec.finish()
+        return rec, started
+
+    rec, started = run(go())
+    assert started and rec.trace_reason == "slow"
+
+
+def test_list_jobs_percentiles_use_individual_entries():
+    kktcmb_trace._RECENT.extend([
+        {"job_id": "a", "duration_ms": 100, "stage_list": [{"name": "batch_submit", "duration_ms": 10}] * 10},
+        {"job_id": "b", "duration_ms": 50, "stage_list": [{"name": "batch_submit", "duration_ms": 12}]},
+    ])
+    stages = list_jobs()["stages"]["batch_submit"]
+    assert stages["count"] == 11 and stages["p95_ms"] == 12
+
+
+def test_get_job_reads_from_disk(trace_dir):
+    (trace_dir / "0123456789ab").mkdir()
+    (trace_dir / "0123456789ab" / "waterfall.json").write_text(json.dumps({"job_id": "0123456789ab"}))
+    assert get_job("0123456789ab") == {"job_id": "0123456789ab"}
+    assert get_job("ffffffffffff") is None
+
+
+def test_prune_only_touches_job_dirs(trace_dir):
+    for i in range(3):
+        d = trace_dir / f"{i:012x}"
+        d.mkdir()
+        (d / "waterfall.json").write_text("{}")
+    (trace_dir / "first.png").write_bytes(b"")
+    (trace_dir / "shared").mkdir()
+    (trace_dir / "aaaaaaaaaaaa").mkdir()  # waterfall.json yok
+    _prune_trace_dir(keep=1)
+    left = sorted(p.name for p in trace_dir.iterdir())
+    assert "shared" in left and "first.png" in left and "aaaaaaaaaaaa" in left
+    assert sum(1 for n in left if n.startswith("0000")) == 1